@@ -1,16 +1,31 @@
+import functools
+import hashlib
+import itertools
 import os
-import uuid
+import re
+import secrets
+import sys
+import threading
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, NamedTuple, Optional, Sequence, Tuple
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-import requests
+from cachetools import TTLCache
+import httpx
+import orjson
 
 from database import db, create_document, get_documents
 
-app = FastAPI(title="MediSphere Pharmacogenomics API", description="VCF analysis and risk prediction")
+app = FastAPI(
+    title="MediSphere Pharmacogenomics API",
+    description="VCF analysis and risk prediction",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,14 +35,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-SUPPORTED_GENES = {"CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD"}
-SUPPORTED_DRUGS = {"CODEINE", "WARFARIN", "CLOPIDOGREL", "SIMVASTATIN", "AZATHIOPRINE", "FLUOROURACIL"}
+SUPPORTED_GENES = frozenset({"CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD"})
+SUPPORTED_DRUGS = frozenset({"CODEINE", "WARFARIN", "CLOPIDOGREL", "SIMVASTATIN", "AZATHIOPRINE", "FLUOROURACIL"})
+SUPPORTED_GENES_BYTES = frozenset(g.encode('ascii') for g in SUPPORTED_GENES)
+MAX_VCF_BYTES = 5_000_000
+
+# Primary gene consulted for each supported drug
+GENE_MAP = {
+    'CODEINE': 'CYP2D6',
+    'WARFARIN': 'CYP2C9',
+    'CLOPIDOGREL': 'CYP2C19',
+    'SIMVASTATIN': 'SLCO1B1',
+    'AZATHIOPRINE': 'TPMT',
+    'FLUOROURACIL': 'DPYD',
+}
 
 class ChatRequest(BaseModel):
     patient_id: Optional[str] = None
     message: str
     provider: Optional[str] = None  # 'gemini' | 'openai' | None
 
+class Variant(NamedTuple):
+    chrom: str
+    pos: str
+    id: str
+    ref: str
+    alt: str
+    gene: str
+    stars: Tuple[str, ...]
+    rs: Optional[str]
+
 @app.get("/")
 def read_root():
     return {"message": "MediSphere API running"}
@@ -58,71 +95,130 @@ def test_database():
 
 # --- Utility functions ---
 
-def parse_vcf(content: str, max_bytes: int = 5_000_000) -> List[Dict[str, Any]]:
+_GENE_RE = re.compile(rb'(?:^|;)GENE=([^;]*)', re.IGNORECASE)
+# Any `=<supported gene>` value; a cheap superset of the lines parse_vcf keeps
+_SUPPORTED_GENE_VALUE_RE = re.compile(
+    b'=(?:' + b'|'.join(re.escape(g) for g in sorted(SUPPORTED_GENES_BYTES)) + rb')(?![^;\s])'
+)
+# Line terminators recognised by bytes.splitlines()
+_EOL_RE = re.compile(rb'[\r\n]')
+
+
+def _find_gene(info: bytes) -> Optional[bytes]:
+    """Return the raw GENE value from an INFO column, or None if absent."""
+    found = _GENE_RE.findall(info)
+    return found[-1] if found else None
+
+
+def _parse_star_rs(info: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Extract the STAR and RS tag values from a raw INFO column.
+    Walks the `;`-delimited fields by index and only decodes those two
+    values; all other tags are skipped without allocating.
+    Keys are matched case-insensitively, the last occurrence wins.
+    """
+    star = rs = None
+    end = len(info)
+    start = 0
+    while start < end:
+        stop = info.find(b';', start)
+        if stop < 0:
+            stop = end
+        eq = info.find(b'=', start, stop)
+        # Only STAR/RS are of interest, so check the key length first
+        klen = eq - start
+        if klen == 4 and info[start:eq].upper() == b'STAR':
+            star = info[eq + 1:stop].decode('utf-8')
+        elif klen == 2 and info[start:eq].upper() == b'RS':
+            rs = info[eq + 1:stop].decode('utf-8')
+        start = stop + 1
+    return star, rs
+
+
+def _candidate_lines(data: bytes):
+    """Yield the lines that mention a supported gene value.
+    The search runs inside the regex engine, so the bulk of a VCF (lines for
+    other genes) is skipped without creating a Python object per line.
+    Lines end at '\n', '\r' or '\r\n', as with bytes.splitlines(). The result
+    is a superset of the lines parse_vcf keeps; it still checks each one.
+    """
+    end = -1
+    for m in _SUPPORTED_GENE_VALUE_RE.finditer(data):
+        pos = m.start()
+        if pos < end:
+            continue
+        # Look back no further than the previous line end, so files without
+        # one kind of terminator are never rescanned from the start
+        lo = max(end, 0)
+        start = max(data.rfind(b'\n', lo, pos), data.rfind(b'\r', lo, pos)) + 1
+        eol = _EOL_RE.search(data, pos)
+        end = eol.start() if eol else len(data)
+        yield data[start:end]
+
+
+def parse_vcf(data: bytes, max_bytes: int = MAX_VCF_BYTES) -> List[Variant]:
     """Parse VCF v4.2 content, extract INFO tags relevant to pharmacogenomics.
+    - Works on the raw upload bytes, decoding only the columns that are kept.
     - Accepts STAR values that may be comma-separated.
     - Normalizes keys to upper-case for robustness.
-    Returns list of variant dicts.
+    Returns list of Variant records.
     """
-    encoded = content.encode("utf-8")
-    if len(encoded) > max_bytes:
+    if len(data) > max_bytes:
         raise HTTPException(status_code=413, detail="VCF exceeds 5MB limit")
     variants = []
-    for line in content.splitlines():
-        if not line or line.startswith('#'):
+    for line in _candidate_lines(data):
+        if not line or line[:1] == b'#':
             continue
-        parts = line.strip().split('\t')
+        # INFO is the 8th column; leave FORMAT/sample columns unsplit
+        parts = line.strip().split(b'\t', 8)
         if len(parts) < 8:
             continue
-        chrom, pos, vid, ref, alt, qual, flt, info = parts[:8]
-        info_dict: Dict[str, Any] = {}
-        for kv in info.split(';'):
-            if '=' in kv:
-                k, v = kv.split('=', 1)
-                info_dict[k.upper()] = v
-            else:
-                info_dict[kv.upper()] = True
-        gene = info_dict.get('GENE')
-        star_raw = info_dict.get('STAR')
-        rs = info_dict.get('RS') or (vid if vid and vid.lower().startswith('rs') else None)
+        # Confirm the GENE tag itself names a supported gene before any decoding
+        gene_raw = _find_gene(parts[7])
+        if gene_raw not in SUPPORTED_GENES_BYTES:
+            continue
+        gene = gene_raw.decode('ascii')
+        try:
+            chrom, pos, vid, ref, alt = (p.decode('utf-8') for p in parts[:5])
+            star_raw, rs = _parse_star_rs(parts[7])
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Unable to decode VCF as UTF-8")
+        rs = rs or (vid if len(vid) >= 2 and vid[0] in 'rR' and vid[1] in 'sS' else None)
         stars = []
         if star_raw:
-            for s in str(star_raw).split(','):
+            for s in star_raw.split(','):
                 s = s.strip()
                 if s:
                     stars.append(s if s.startswith('*') else f"*{s}")
-        if gene in SUPPORTED_GENES:
-            variants.append({
-                "CHROM": chrom,
-                "POS": pos,
-                "ID": vid,
-                "REF": ref,
-                "ALT": alt,
-                "INFO": info_dict,
-                "GENE": gene,
-                "STARS": stars,
-                "RS": rs,
-            })
+        variants.append(Variant(chrom, pos, vid, ref, alt, gene, tuple(stars), rs))
     return variants
 
 # CPIC-inspired allele function categories (simplified)
-LOSS_CYP2D6 = {'*3','*4','*5','*6'}
-DECREASED_CYP2D6 = {'*17','*41'}
+LOSS_CYP2D6 = frozenset({'*3','*4','*5','*6'})
+DECREASED_CYP2D6 = frozenset({'*17','*41'})
+
+LOSS_CYP2C19 = frozenset({'*2','*3','*4'})
+INCREASED_CYP2C19 = frozenset({'*17'})
+
+LOSS_CYP2C9 = frozenset({'*2','*3'})
 
-LOSS_CYP2C19 = {'*2','*3','*4'}
-INCREASED_CYP2C19 = {'*17'}
+LOSS_TPMT = frozenset({'*2','*3A','*3B','*3C'})
 
-LOSS_CYP2C9 = {'*2','*3'}
+REDUCED_DPYD = frozenset({'*2A','*13'})
+CRITICAL_RS_DPYD = frozenset({'RS3918290','RS55886062'})
 
-LOSS_TPMT = {'*2','*3A','*3B','*3C'}
+SLCO1B1_DECREASED = frozenset({'*5','RS4149056'})
 
-REDUCED_DPYD = {'*2A','*13'}
-CRITICAL_RS_DPYD = {'RS3918290','RS55886062'}
 
-SLCO1B1_DECREASED = {'*5','RS4149056'}
+def _markers(*groups: frozenset) -> frozenset:
+    """Union allele marker sets for exact per-allele lookups.
+    rs-style markers also match their '*'-prefixed form, since parse_vcf
+    prefixes bare STAR values with '*'.
+    """
+    markers = frozenset().union(*groups)
+    return markers | {f"*{m}" for m in markers if not m.startswith('*')}
 
 
-def determine_diplotype(variants: List[Dict[str, Any]], gene: str) -> str:
+def determine_diplotype(variants: List[Variant], gene: str) -> str:
     """Infer a diplotype from STAR annotations.
     - Picks up to two distinct star alleles.
     - If duplication (XN) is present, include it.
@@ -130,7 +226,7 @@ def determine_diplotype(variants: List[Dict[str, Any]], gene: str) -> str:
     """
     stars: List[str] = []
     for v in variants:
-        stars.extend(v.get('STARS', []))
+        stars.extend(v.stars)
     if not stars:
         return "Unknown"
     # Normalize and unique preserving order
@@ -151,55 +247,65 @@ def determine_diplotype(variants: List[Dict[str, Any]], gene: str) -> str:
     return f"{base[0]}/*1"
 
 
+# Per-gene phenotype rules: (loss, decreased, increased, duplication -> URM).
+# DPYD reduced/critical markers are treated as loss: two -> PM, one -> IM.
+_GENE_RULES: Dict[str, Tuple[frozenset, frozenset, frozenset, bool]] = {
+    'CYP2D6': (_markers(LOSS_CYP2D6), _markers(DECREASED_CYP2D6), frozenset(), True),
+    'CYP2C19': (_markers(LOSS_CYP2C19), frozenset(), _markers(INCREASED_CYP2C19), False),
+    'CYP2C9': (_markers(LOSS_CYP2C9), frozenset(), frozenset(), False),
+    'SLCO1B1': (frozenset(), _markers(SLCO1B1_DECREASED), frozenset(), False),
+    'TPMT': (_markers(LOSS_TPMT), frozenset(), frozenset(), False),
+    'DPYD': (_markers(REDUCED_DPYD, CRITICAL_RS_DPYD), frozenset(), frozenset(), False),
+}
+
+_DUP_SUFFIX = 'XN'
+
+
+def _classify(d: str, rules: tuple) -> str:
+    loss_set, decreased_set, increased_set, dup_urm = rules
+    # Compare whole alleles, so e.g. '*1' no longer matches inside '*17'.
+    # Kept as a list so homozygous calls ('*4/*4') count twice.
+    # Duplications are looked up by their base allele ('*4XN' -> '*4').
+    alleles: List[str] = []
+    dup_bases: List[str] = []
+    for a in d.split('/'):
+        if a.endswith(_DUP_SUFFIX):
+            a = a[:-len(_DUP_SUFFIX)]
+            dup_bases.append(a)
+        alleles.append(a)
+    has_ref = '*1' in alleles
+    loss = sum(1 for a in alleles if a in loss_set)
+    if loss >= 2:
+        return 'PM'
+    # A single no-function allele is at least IM, whatever the partner allele
+    if loss:
+        return 'IM'
+    if not decreased_set.isdisjoint(alleles):
+        return 'IM'
+    increased = sum(1 for a in alleles if a in increased_set)
+    if increased and (has_ref or increased >= 2):
+        return 'RM'
+    # Only extra copies of a functional allele raise activity
+    if dup_urm and any(a not in loss_set and a not in decreased_set for a in dup_bases):
+        return 'URM'
+    return 'NM'
+
+
+@functools.lru_cache(maxsize=4096)
+def _phenotype_cached(gene: str, diplotype: str) -> str:
+    rules = _GENE_RULES.get(gene)
+    if rules is None:
+        return 'Unknown'
+    return _classify(diplotype, rules)
+
+
 def phenotype_from_diplotype(gene: str, diplotype: str) -> str:
-    g = gene.upper()
-    d = diplotype.upper()
-    if g == 'CYP2D6':
-        if any(a in d for a in LOSS_CYP2D6) and any(b in d for b in LOSS_CYP2D6):
-            return 'PM'
-        if any(a in d for a in LOSS_CYP2D6) and '*1' in d:
-            return 'IM'
-        if any(a in d for a in DECREASED_CYP2D6):
-            return 'IM'
-        if 'XN' in d:
-            return 'URM'
-        return 'NM'
-    if g == 'CYP2C19':
-        if any(a in d for a in LOSS_CYP2C19) and any(b in d for b in LOSS_CYP2C19):
-            return 'PM'
-        if any(a in d for a in LOSS_CYP2C19) and '*1' in d:
-            return 'IM'
-        if '*17' in d and '*1' in d:
-            return 'RM'
-        return 'NM'
-    if g == 'CYP2C9':
-        if any(a in d for a in LOSS_CYP2C9) and any(b in d for b in LOSS_CYP2C9):
-            return 'PM'
-        if any(a in d for a in LOSS_CYP2C9) and '*1' in d:
-            return 'IM'
-        return 'NM'
-    if g == 'SLCO1B1':
-        if any(a in d for a in SLCO1B1_DECREASED):
-            return 'IM'
-        return 'NM'
-    if g == 'TPMT':
-        if any(a in d for a in LOSS_TPMT) and any(b in d for b in LOSS_TPMT):
-            return 'PM'
-        if any(a in d for a in LOSS_TPMT) and '*1' in d:
-            return 'IM'
-        return 'NM'
-    if g == 'DPYD':
-        if any(a in d for a in REDUCED_DPYD) or any(rs in d for rs in CRITICAL_RS_DPYD):
-            # If two reduced/critical markers
-            cnt = sum(1 for a in REDUCED_DPYD if a in d) + sum(1 for rs in CRITICAL_RS_DPYD if rs in d)
-            return 'PM' if cnt >= 2 else 'IM'
-        return 'NM'
-    return 'Unknown'
-
-
-def risk_for_drug(drug: str, gene: str, phenotype: str) -> Dict[str, Any]:
-    drug = drug.upper()
-    phenotype = phenotype.upper()
+    # Canonicalize before the cache so case variants share one entry
+    return _phenotype_cached(gene.upper(), diplotype.upper())
+
+
+@functools.lru_cache(maxsize=4096)
+def _risk_cached(drug: str, gene: str, phenotype: str) -> Mapping[str, Any]:
     risk_label = 'Unknown'
     severity = 'none'
     cpic_ref = ''
@@ -280,40 +386,64 @@ def risk_for_drug(drug: str, gene: str, phenotype: str) -> Dict[str, Any]:
             confidence = 0.76
     else:
         action = 'Insufficient evidence for gene-drug pair'
-    return {
+    # Read-only view, since the same object is shared by every cache hit
+    return MappingProxyType({
         "risk_label": risk_label,
         "confidence_score": round(confidence, 2),
         "severity": severity,
         "cpic": cpic_ref,
         "action": action,
         "dose": dose,
-    }
+    })
+
+
+def risk_for_drug(drug: str, gene: str, phenotype: str) -> Mapping[str, Any]:
+    return _risk_cached(drug.upper(), gene, phenotype.upper())
 
 
-def generate_llm_explanation(drug: str, gene: str, variants: List[Dict[str, Any]], phenotype: str, risk: Dict[str, Any]) -> Dict[str, str]:
-    rsids = [v.get('RS') for v in variants if v.get('RS')]
-    rs_text = ', '.join([r.lower() if r else '' for r in rsids]) or 'N/A'
-    summary = (
+@functools.lru_cache(maxsize=1024)
+def _explain_templates(drug: str, gene: str, phenotype: str, risk_label: str,
+                       cpic: str, action: str, dose: str) -> Tuple[str, str, str, str, str]:
+    # Text either side of the rsID list; the list itself is unbounded, so it stays out of the key
+    summary_head = (
         f"For {drug.title()}, the patient's {gene} phenotype is {phenotype}. "
-        f"Based on detected variants ({rs_text}), the assessed risk is '{risk['risk_label']}'."
+        f"Based on detected variants ("
     )
-    mechanism = (
-        f"{gene} influences {drug.title()} pharmacokinetics/pharmacodynamics. Variants like {rs_text} can alter enzyme or transporter activity, "
-        f"leading to changes in drug metabolism or exposure."
+    summary_tail = f"), the assessed risk is '{risk_label}'."
+    mechanism_head = f"{gene} influences {drug.title()} pharmacokinetics/pharmacodynamics. Variants like "
+    mechanism_tail = (
+        " can alter enzyme or transporter activity, "
+        "leading to changes in drug metabolism or exposure."
     )
     clinical = (
-        f"Following CPIC guidance ({risk.get('cpic','')}), the recommended action is: {risk['action']}. "
-        f"Dose adjustment: {risk['dose'] or 'None'}."
+        f"Following CPIC guidance ({cpic}), the recommended action is: {action}. "
+        f"Dose adjustment: {dose or 'None'}."
     )
+    return summary_head, summary_tail, mechanism_head, mechanism_tail, clinical
+
+
+def generate_llm_explanation(drug: str, gene: str, rsids: Sequence[str], phenotype: str, risk: Mapping[str, Any]) -> Dict[str, str]:
+    summary_head, summary_tail, mechanism_head, mechanism_tail, clinical = _explain_templates(
+        drug, gene, phenotype, risk['risk_label'], risk.get('cpic', ''), risk['action'], risk['dose'],
+    )
+    # rsIDs stay in detection order, as they appear in the text
+    rs_text = ', '.join([r.lower() for r in rsids if r]) or 'N/A'
     return {
-        "summary": summary,
-        "mechanism": mechanism,
+        "summary": summary_head + rs_text + summary_tail,
+        "mechanism": mechanism_head + rs_text + mechanism_tail,
         "clinical_significance": clinical,
     }
 
 # --- LLM Integrations ---
 
-def _openai_generate(content: str) -> str:
+# Shared client so keep-alive connections to the OpenAI API are reused across requests
+_OPENAI_CLIENT = httpx.AsyncClient(timeout=12, limits=httpx.Limits(max_keepalive_connections=20))
+
+@app.on_event("shutdown")
+async def _close_openai_client():
+    await _OPENAI_CLIENT.aclose()
+
+async def _openai_generate(content: str) -> str:
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
         return ''
@@ -331,9 +461,9 @@ def _openai_generate(content: str) -> str:
         'temperature': 0.7
     }
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=12)
+        resp = await _OPENAI_CLIENT.post(url, headers=headers, json=payload)
         if resp.status_code == 200:
-            data = resp.json()
+            data = orjson.loads(resp.content)
             choice = (data.get('choices') or [{}])[0]
             msg = (choice.get('message') or {}).get('content')
             return msg or ''
@@ -341,52 +471,135 @@ def _openai_generate(content: str) -> str:
     except Exception:
         return ''
 
+# Recent reports per patient for /chat context; short TTL since /analyze may add more
+_REPORTS_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_REPORTS_CACHE_LOCK = threading.Lock()
+# Per-patient generation, bumped whenever new reports are stored. Values come
+# from a global counter and are never reused, so an evicted entry can only
+# cause a skipped store, never a stale one.
+_REPORTS_GEN: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+_REPORTS_GEN_COUNTER = itertools.count(1)
+
+def _cached_recent_reports(patient_id: str) -> List[Dict[str, Any]]:
+    with _REPORTS_CACHE_LOCK:
+        cached = _REPORTS_CACHE.get(patient_id)
+        if cached is not None:
+            return cached
+        gen = _REPORTS_GEN.get(patient_id)
+        if gen is None:
+            gen = _REPORTS_GEN[patient_id] = next(_REPORTS_GEN_COUNTER)
+    reports = get_documents('pharmacogenomicreport', {"patient_id": patient_id}, limit=3)
+    with _REPORTS_CACHE_LOCK:
+        # Reports stored while we were querying would make this result stale
+        if _REPORTS_GEN.get(patient_id) == gen:
+            _REPORTS_CACHE[patient_id] = reports
+    return reports
+
+# Per-upload calls keyed on a hash of the upload, so re-uploads skip parsing.
+# Only what the response needs is kept, and the cache is bounded by the
+# approximate size of its entries rather than their count.
+_VCF_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_VCF_CACHE_LOCK = threading.Lock()
+
+def _vcf_entry_size(entry: tuple) -> int:
+    _, rsids, gene_calls = entry
+    size = sys.getsizeof(rsids) + sum(map(sys.getsizeof, rsids))
+    for call in gene_calls.values():
+        # Per-gene rsID strings are shared with rsids; only the tuple is extra
+        size += sys.getsizeof(call[3])
+    return size
+
+_VCF_CACHE: TTLCache = TTLCache(maxsize=_VCF_CACHE_MAX_BYTES, ttl=600, getsizeof=_vcf_entry_size)
+
+def _analyze_variants(data: bytes) -> tuple:
+    """Parse a VCF and derive the per-gene calls shared by all drugs.
+    Returns (total_variants, rsids, gene_calls), where gene_calls maps each
+    gene to (diplotype, phenotype, missing_annotations, rsids); rsids of
+    unannotated variants are ''. Results are cached by content hash.
+    """
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    with _VCF_CACHE_LOCK:
+        cached = _VCF_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    variants = parse_vcf(data)
+
+    # Single pass: group variants by gene and collect rsIDs for the summary
+    by_gene: Dict[str, List[Variant]] = {}
+    rsids: List[str] = []
+    for v in variants:
+        by_gene.setdefault(v.gene, []).append(v)
+        if v.rs:
+            rsids.append(v.rs)
+
+    # Call diplotype/phenotype and annotation coverage once per gene, shared by all drugs
+    gene_calls: Dict[str, tuple] = {}
+    for gene, gene_vars in by_gene.items():
+        diplotype = determine_diplotype(gene_vars, gene)
+        phenotype = phenotype_from_diplotype(gene, diplotype) if diplotype != 'Unknown' else 'Unknown'
+        has_stars = has_rs = False
+        for v in gene_vars:
+            has_stars = has_stars or bool(v.stars)
+            has_rs = has_rs or bool(v.rs)
+            if has_stars and has_rs:
+                break
+        gene_rsids = tuple([v.rs or '' for v in gene_vars])
+        gene_calls[gene] = (diplotype, phenotype, not (has_stars and has_rs), gene_rsids)
+
+    result = (len(variants), tuple(rsids), gene_calls)
+    if _vcf_entry_size(result) <= _VCF_CACHE_MAX_BYTES:
+        with _VCF_CACHE_LOCK:
+            _VCF_CACHE[key] = result
+    return result
+
+def _store_reports(reports: List[Dict[str, Any]]) -> None:
+    """Persist analysis reports; runs after the response has been sent."""
+    stored = set()
+    for report in reports:
+        try:
+            create_document('pharmacogenomicreport', report)
+            stored.add(report['patient_id'])
+        except Exception:
+            pass
+    with _REPORTS_CACHE_LOCK:
+        for pid in stored:
+            _REPORTS_GEN[pid] = next(_REPORTS_GEN_COUNTER)
+            _REPORTS_CACHE.pop(pid, None)
+
 @app.post("/analyze")
 async def analyze_vcf(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     drugs: str = Form(...),
     patient_id: str | None = Form(None)
 ):
     if not file.filename.lower().endswith('.vcf'):
         raise HTTPException(status_code=400, detail="File must be a VCF (.vcf)")
-    data = await file.read()
-    if len(data) > 5_000_000:
-        raise HTTPException(status_code=413, detail="VCF exceeds 5MB limit")
-    try:
-        content = data.decode('utf-8')
-    except Exception:
-        raise HTTPException(status_code=400, detail="Unable to decode VCF as UTF-8")
-
-    variants = parse_vcf(content)
+    # Read in chunks so oversized uploads are rejected without buffering them whole
+    buf = bytearray()
+    while chunk := await file.read(65536):
+        buf.extend(chunk)
+        if len(buf) > MAX_VCF_BYTES:
+            raise HTTPException(status_code=413, detail="VCF exceeds 5MB limit")
+    data = bytes(buf)
+
+    # CPU-bound; parse off the event loop so other requests keep being served
+    total_variants, rsids, gene_calls = await run_in_threadpool(_analyze_variants, data)
     drugs_list = [d.strip().upper() for d in drugs.split(',') if d.strip()]
     drugs_list = [d for d in drugs_list if d in SUPPORTED_DRUGS]
     if not drugs_list:
         raise HTTPException(status_code=400, detail="No supported drugs provided")
 
-    genes_detected = {v['GENE'] for v in variants}
-    rsids = [v['RS'] for v in variants if v.get('RS')]
-
     reports: List[Dict[str, Any]] = []
     now_ts = datetime.now(timezone.utc).isoformat()
-    pid = patient_id or f"PATIENT_{uuid.uuid4().hex[:8].upper()}"
+    pid = patient_id or f"PATIENT_{secrets.token_hex(4).upper()}"
 
     for drug in drugs_list:
-        gene_map = {
-            'CODEINE': 'CYP2D6',
-            'WARFARIN': 'CYP2C9',
-            'CLOPIDOGREL': 'CYP2C19',
-            'SIMVASTATIN': 'SLCO1B1',
-            'AZATHIOPRINE': 'TPMT',
-            'FLUOROURACIL': 'DPYD',
-        }
-        primary_gene = gene_map.get(drug)
-        gene_vars = [v for v in variants if v['GENE'] == primary_gene]
-        diplotype = determine_diplotype(gene_vars, primary_gene)
-        phenotype = phenotype_from_diplotype(primary_gene, diplotype) if diplotype != 'Unknown' else 'Unknown'
+        primary_gene = GENE_MAP.get(drug)
+        diplotype, phenotype, missing_annotations, gene_rsids = gene_calls.get(primary_gene, ('Unknown', 'Unknown', True, ()))
         risk = risk_for_drug(drug, primary_gene, phenotype)
-        explanation = generate_llm_explanation(drug, primary_gene, gene_vars, phenotype, risk)
-
-        missing_annotations = not gene_vars or not any(v.get('STARS') for v in gene_vars) or not any(v.get('RS') for v in gene_vars)
+        explanation = generate_llm_explanation(drug, primary_gene, gene_rsids, phenotype, risk)
 
         result: Dict[str, Any] = {
             "patient_id": pid,
@@ -401,7 +614,7 @@ async def analyze_vcf(
                 "primary_gene": primary_gene,
                 "diplotype": diplotype,
                 "phenotype": phenotype,
-                "detected_variants": [{"rsid": (v.get('RS') or '')} for v in gene_vars] or [{"rsid": ""}]
+                "detected_variants": [{"rsid": rs} for rs in gene_rsids] or [{"rsid": ""}]
             },
             "clinical_recommendation": {
                 "cpic_guideline_reference": risk['cpic'],
@@ -420,28 +633,25 @@ async def analyze_vcf(
             }
         }
 
-        try:
-            create_document('pharmacogenomicreport', result)
-        except Exception:
-            pass
-
         reports.append(result)
 
+    background_tasks.add_task(_store_reports, reports)
+
     summary = {
         "patient_id": pid,
-        "total_variants": len(variants),
-        "genes_covered": list(genes_detected),
+        "total_variants": total_variants,
+        "genes_covered": list(gene_calls),
         "rsids_detected": rsids,
     }
 
     return {"reports": reports, "summary": summary}
 
 @app.post('/chat')
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     patient_reports = []
     if req.patient_id:
         try:
-            patient_reports = get_documents('pharmacogenomicreport', {"patient_id": req.patient_id}, limit=3)
+            patient_reports = await run_in_threadpool(_cached_recent_reports, req.patient_id)
         except Exception:
             patient_reports = []
 
@@ -455,7 +665,7 @@ def chat(req: ChatRequest):
     user_prompt = f"Question: {req.message}\n\nRecent context:\n{context or 'No prior reports.'}"
 
     # Force OpenAI (GPT‑4o) usage for consistency
-    llm_text = _openai_generate(user_prompt)
+    llm_text = await _openai_generate(user_prompt)
 
     if not llm_text:
         llm_text = (
@@ -465,7 +675,7 @@ def chat(req: ChatRequest):
         )
 
     try:
-        create_document('chatmessage', {
+        await run_in_threadpool(create_document, 'chatmessage', {
             "patient_id": req.patient_id,
             "role": "assistant",
             "message": llm_text,
@@ -0,0 +1,48 @@
+import pytest
+
+from main import phenotype_from_diplotype
+
+
+# Clinical regression table for the diplotype -> phenotype rules
+PHENOTYPE_CASES = [
+    # One no-function allele is IM whatever the partner allele, two are PM
+    ('CYP2C19', '*2/*1', 'IM'),
+    ('CYP2C19', '*2/*17', 'IM'),
+    ('CYP2C19', '*2/*3', 'PM'),
+    ('CYP2D6', '*4/*1', 'IM'),
+    ('CYP2D6', '*4/*2', 'IM'),
+    ('CYP2D6', '*4/*10', 'IM'),
+    ('CYP2D6', '*4/*4', 'PM'),
+    ('CYP2C9', '*2/*8', 'IM'),
+    ('CYP2C9', '*2/*17', 'IM'),
+    ('CYP2C9', '*3/*3', 'PM'),
+    ('TPMT', '*3A/*1', 'IM'),
+    ('TPMT', '*3A/*2', 'PM'),
+    ('DPYD', '*2A/*1', 'IM'),
+    ('DPYD', '*2A/*13', 'PM'),
+    ('DPYD', '*RS3918290/*1', 'IM'),
+    # Duplications are classified by their base allele
+    ('CYP2D6', '*1XN/*1', 'URM'),
+    ('CYP2D6', '*2XN/*1', 'URM'),
+    ('CYP2D6', '*4XN/*1', 'IM'),
+    ('CYP2D6', '*4XN/*4', 'PM'),
+    ('CYP2D6', '*41XN/*1', 'IM'),
+    # Decreased/increased function, matched as whole alleles
+    ('CYP2D6', '*41/*1', 'IM'),
+    ('CYP2D6', '*10/*17', 'IM'),
+    ('CYP2C19', '*17/*1', 'RM'),
+    ('CYP2C19', '*17/*17', 'RM'),
+    ('SLCO1B1', '*5/*1', 'IM'),
+    ('SLCO1B1', '*1/*1', 'NM'),
+    ('CYP2D6', '*1/*1', 'NM'),
+    ('UNKNOWNGENE', '*1/*1', 'Unknown'),
+]
+
+
+@pytest.mark.parametrize("gene,diplotype,expected", PHENOTYPE_CASES)
+def test_phenotype_from_diplotype(gene, diplotype, expected):
+    assert phenotype_from_diplotype(gene, diplotype) == expected
+
+
+def test_phenotype_is_case_insensitive():
+    assert phenotype_from_diplotype('cyp2d6', '*4xn/*1') == 'IM'